@@ -1,5 +1,6 @@
 import streamlit as st
 from assistant_client import create_thread, run_turn
+from profiler import profile_turn
 from logger import info, error, debug, warning
 
 debug("Starting Facebook Ads AI Assistant application")
@@ -24,6 +25,11 @@ if "thread_id" not in st.session_state:
         error(f"Failed to initialize session: {e}")
         st.error(f"Failed to initialize: {e}")
 
+# Per-session profiling switch: ?profile=1 turns it on, ?profile=0 off (default: PROFILE_TURNS env)
+if "profile" in st.query_params:
+    st.session_state.profile = st.query_params["profile"].strip().lower() in ("1", "true", "yes", "on")
+    debug(f"Profiling for this session set to {st.session_state.profile}")
+
 # Reset button
 if st.button("🔄 Start New Conversation"):
     info("User requested to start a new conversation")
@@ -56,23 +62,26 @@ if user_input:
     placeholder = None
     debug(f"Starting assistant response stream for thread {st.session_state.thread_id}")
     
-    try:
-        for chunk in run_turn(st.session_state.thread_id, user_input):
-            assistant_msg += chunk
+    # Profile the whole turn including rendering; a with-block (unlike the run_turn generator)
+    # always ends here, so the session's profiling state can't leak into later work
+    with profile_turn(f"turn_{st.session_state.thread_id}", enabled=st.session_state.get("profile")):
+        try:
+            for chunk in run_turn(st.session_state.thread_id, user_input, profile=st.session_state.get("profile")):
+                assistant_msg += chunk
             
-            # Only create the placeholder once we have some content
-            if placeholder is None and assistant_msg.strip():
-                placeholder = st.chat_message("assistant")
+                # Only create the placeholder once we have some content
+                if placeholder is None and assistant_msg.strip():
+                    placeholder = st.chat_message("assistant")
             
-            # Only write to placeholder if it exists
-            if placeholder is not None:
-                placeholder.write(assistant_msg)
-    except Exception as e:
-        error(f"Error during run_turn streaming: {e}")
-        assistant_msg = f"I encountered an error: {str(e)}"
-        if placeholder is None:
-            placeholder = st.chat_message("assistant")
-        placeholder.write(assistant_msg)
+                # Only write to placeholder if it exists
+                if placeholder is not None:
+                    placeholder.write(assistant_msg)
+        except Exception as e:
+            error(f"Error during run_turn streaming: {e}")
+            assistant_msg = f"I encountered an error: {str(e)}"
+            if placeholder is None:
+                placeholder = st.chat_message("assistant")
+            placeholder.write(assistant_msg)
 
     # In case we received no content at all, create placeholder at the end
     if placeholder is None:
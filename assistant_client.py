@@ -1,20 +1,66 @@
-import os, json, time
-from openai import OpenAI
+import os, json, time, uuid
+from openai import OpenAI, APIConnectionError, APIStatusError, RateLimitError
 from datetime import datetime
 from fb_api import get_posts_by_range, create_campaign, boost_posts
 from logger import info, error, debug, warning
+from profiler import profile_turn
+from resilience import resilient_call
 
 API_KEY = os.getenv("OPENAI_API_KEY")
 ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
 PAGE_ID = os.getenv("FB_PAGE_ID")
 
 info(f"Starting assistant client with ASSISTANT_ID: {ASSISTANT_ID}, PAGE_ID: {PAGE_ID}")
-client = OpenAI(api_key=API_KEY)
+# Retries are handled by resilient_call so they share backoff and circuit breakers with fb_api.
+# Creates are only resent after checking (via a request_id in metadata) that the failed attempt never landed.
+client = OpenAI(api_key=API_KEY, max_retries=0)
+
+def _is_transient(e: Exception) -> bool:
+    # Same rules as the SDK's own retries: the server's x-should-retry wins, then 408/409/429/5xx
+    if isinstance(e, APIStatusError):
+        should_retry = e.response.headers.get("x-should-retry")
+        if should_retry in ("true", "false"):
+            return should_retry == "true"
+        return e.status_code in (408, 409, 429) or e.status_code >= 500
+    return isinstance(e, APIConnectionError)
+
+def _is_rejected(e: Exception) -> bool:
+    return isinstance(e, RateLimitError)
+
+def _retry_after(e: Exception) -> float | None:
+    response = getattr(e, "response", None)
+    headers = response.headers if response is not None else {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass  # HTTP-date form, fall back to backoff
+    return None
+
+def _openai_call(endpoint: str, fn, idempotent: bool = False, recover=None):
+    return resilient_call(f"openai.{endpoint}", fn, idempotent=idempotent, is_transient=_is_transient,
+                          is_rejected=_is_rejected, retry_after=_retry_after, recover=recover)
+
+def _find_by_request_id(items, request_id: str):
+    """Recovery check for creates: the item a failed attempt created, if any."""
+    return next((item for item in items if (item.metadata or {}).get("request_id") == request_id), None)
+
+def _run_past_tool_calls(thread_id: str, run_id: str, tool_call_ids: set[str]):
+    """Recovery check for submit_tool_outputs: the run, if it is no longer waiting on these tool calls."""
+    run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+    if run.status == "requires_action" and run.required_action:
+        pending = {t.id for t in run.required_action.submit_tool_outputs.tool_calls}
+        if pending & tool_call_ids:
+            return None
+    return run
 
 def create_thread() -> str:
     debug("Creating new thread")
     try:
-        thread = client.beta.threads.create()
+        # A duplicate empty thread from a retry is never used, so this is safe to retry
+        thread = _openai_call("threads.create", lambda: client.beta.threads.create(), idempotent=True)
         info(f"Created new thread with ID: {thread.id}")
         return thread.id
     except Exception as e:
@@ -24,11 +70,15 @@ def create_thread() -> str:
 def post_user_message(thread_id: str, content: str):
     debug(f"Posting user message to thread {thread_id}")
     try:
-        message = client.beta.threads.messages.create(
+        request_id = uuid.uuid4().hex
+        message = _openai_call("messages.create", lambda: client.beta.threads.messages.create(
             thread_id=thread_id,
             role="user",
-            content=content
-        )
+            content=content,
+            metadata={"request_id": request_id}
+        ), recover=lambda: _find_by_request_id(
+            client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=5).data, request_id
+        ))
         info(f"Posted user message ID: {message.id} to thread {thread_id}")
         return message
     except Exception as e:
@@ -40,8 +90,11 @@ def call_GetPosts(args: dict) -> str:
     try:
         since = datetime.fromisoformat(args["since"])
         until = datetime.fromisoformat(args["until"])
-        debug(f"Fetching posts from {since} to {until}")
-        posts = get_posts_by_range(PAGE_ID, since, until)
+        limit = int(args["limit"]) if args.get("limit") is not None else None
+        if limit is not None and limit < 1:
+            raise ValueError(f"'limit' must be at least 1, got {limit}")
+        debug(f"Fetching posts from {since} to {until} (limit={limit})")
+        posts = get_posts_by_range(PAGE_ID, since, until, limit=limit)
         if not posts:
             warning(f"No posts found from {args['since']} to {args['until']}")
             return f"No posts found from {args['since']} to {args['until']}."
@@ -52,7 +105,7 @@ def call_GetPosts(args: dict) -> str:
         error(f"Error in GetPosts: {e}")
         return f"Error in GetPosts: {e}"
 
-def call_CreateCampaign(args: dict) -> str:
+def call_CreateCampaign(args: dict, created: dict | None = None) -> str:
     info(f"Tool call: CreateCampaign with args: {args}")
     try:
         name = args["name"]
@@ -62,12 +115,14 @@ def call_CreateCampaign(args: dict) -> str:
         debug(f"Creating campaign '{name}' with objective '{objective}' and daily budget {budget} USD")
         res = create_campaign(name, objective, daily_cents)
         info(f"Campaign created: {res}")
+        if created is not None:
+            created.setdefault("campaign_ids", []).append(res["campaign_id"])
         return f"Campaign '{name}' created with ID: {res['campaign_id']}."
     except Exception as e:
         error(f"Error in CreateCampaign: {e}")
         return f"Error in CreateCampaign: {e}"
 
-def call_BoostPosts(args: dict) -> str:
+def call_BoostPosts(args: dict, created: dict | None = None) -> str:
     info(f"Tool call: BoostPosts with args: {args}")
     try:
         campaign_id = args["campaign_id"]
@@ -79,6 +134,9 @@ def call_BoostPosts(args: dict) -> str:
         debug(f"Boosting posts {post_ids} under campaign {campaign_id} with goal {opt_goal}")
         res = boost_posts(campaign_id, post_ids, opt_goal, bid_cents, geos)
         info(f"Posts boosted: {res}")
+        if created is not None:
+            created.setdefault("ad_set_ids", []).append(res["ad_set_id"])
+            created.setdefault("ad_ids", []).extend(res["ad_ids"])
         return (
             f"Boosted {len(post_ids)} posts under ad set {res['ad_set_id']}. "
                 f"Ad IDs: {res['ad_ids']}"
@@ -87,8 +145,20 @@ def call_BoostPosts(args: dict) -> str:
         error(f"Error in BoostPosts: {e}")
         return f"Error in BoostPosts: {e}"
 
-def run_turn(thread_id: str, user_input: str):
-    """ Generator: yields assistant output (streamed). """
+def run_turn(thread_id: str, user_input: str, profile: bool | None = None, created: dict | None = None, outcome: dict | None = None):
+    """
+    Generator: yields assistant output (streamed). Set `profile` to force profiling on/off for this turn.
+    If `created` is given, IDs of campaigns, ad sets and ads created during the turn are added to it.
+    Failures are still yielded as text for the chat; if `outcome` is given, outcome["error"] is also
+    set so callers can tell a failed turn from a reply.
+    """
+    # Drain the turn inside the profile block: a generator suspended mid-profile and then
+    # abandoned would leave this thread's profiling state set. _run_turn yields once anyway.
+    with profile_turn(f"turn_{thread_id}", enabled=profile):
+        chunks = list(_run_turn(thread_id, user_input, created, outcome if outcome is not None else {}))
+    yield from chunks
+
+def _run_turn(thread_id: str, user_input: str, created: dict | None, outcome: dict):
     info(f"Starting new conversation turn for thread {thread_id}")
     debug(f"User input: {user_input}")
     
@@ -97,6 +167,7 @@ def run_turn(thread_id: str, user_input: str):
         post_user_message(thread_id, user_input)
     except Exception as e:
         error(f"Failed to post user message: {e}")
+        outcome["error"] = f"Failed to post user message: {e}"
         yield f"Error: Failed to send your message. {str(e)}"
         return
 
@@ -107,12 +178,16 @@ def run_turn(thread_id: str, user_input: str):
     # 2) first run (sync) to detect function_call
     try:
         info(f"Creating run for thread {thread_id}")
-        run = client.beta.threads.runs.create(
+        request_id = uuid.uuid4().hex
+        run = _openai_call("runs.create", lambda: client.beta.threads.runs.create(
             thread_id=thread_id,
             assistant_id=ASSISTANT_ID,
             additional_instructions=additional_instructions,
+            metadata={"request_id": request_id},
             stream=False
-        )
+        ), recover=lambda: _find_by_request_id(
+            client.beta.threads.runs.list(thread_id=thread_id, order="desc", limit=5).data, request_id
+        ))
         
         debug(f"Run created with ID: {run.id}, status: {run.status}")
         
@@ -120,10 +195,10 @@ def run_turn(thread_id: str, user_input: str):
         run_start_time = time.time()
         while run.status not in ["completed", "failed", "cancelled", "expired"]:
             time.sleep(0.5)
-            run = client.beta.threads.runs.retrieve(
+            run = _openai_call("runs.retrieve", lambda: client.beta.threads.runs.retrieve(
                 thread_id=thread_id,
                 run_id=run.id
-            )
+            ), idempotent=True)
             
             # Log status changes and duration
             run_duration = time.time() - run_start_time
@@ -147,9 +222,9 @@ def run_turn(thread_id: str, user_input: str):
                         if name == "GetPosts":
                             result = call_GetPosts(args)
                         elif name == "CreateCampaign":
-                            result = call_CreateCampaign(args)
+                            result = call_CreateCampaign(args, created)
                         elif name == "BoostPosts":
-                            result = call_BoostPosts(args)
+                            result = call_BoostPosts(args, created)
                         else:
                             error(f"Unknown function '{name}'")
                             result = f"Error: unknown function '{name}'"
@@ -167,11 +242,12 @@ def run_turn(thread_id: str, user_input: str):
                 
                 # Submit outputs
                 debug(f"Submitting {len(tool_outputs)} tool outputs")
-                run = client.beta.threads.runs.submit_tool_outputs(
+                tool_call_ids = {t["tool_call_id"] for t in tool_outputs}
+                run = _openai_call("runs.submit_tool_outputs", lambda: client.beta.threads.runs.submit_tool_outputs(
                     thread_id=thread_id,
                     run_id=run.id,
                     tool_outputs=tool_outputs
-                )
+                ), recover=lambda: _run_past_tool_calls(thread_id, run.id, tool_call_ids))
         
         # Log final run status
         run_total_duration = time.time() - run_start_time
@@ -181,12 +257,13 @@ def run_turn(thread_id: str, user_input: str):
             warning(f"Run {run.id} ended with status {run.status} after {run_total_duration:.2f}s")
             if hasattr(run, 'last_error'):
                 error(f"Run error: {run.last_error}")
+            outcome["error"] = f"Run ended with status {run.status}: {getattr(run, 'last_error', None)}"
     
         # Get messages, focusing on the newest assistant message
-        messages = client.beta.threads.messages.list(
+        messages = _openai_call("messages.list", lambda: client.beta.threads.messages.list(
             thread_id=thread_id,
             order="desc"
-        )
+        ), idempotent=True)
         
         latest_message = next((m for m in messages.data if m.role == "assistant"), None)
         
@@ -202,8 +279,10 @@ def run_turn(thread_id: str, user_input: str):
             yield content_text
         else:
             warning("No assistant message found after run completion")
+            outcome["error"] = "No assistant message found after run completion"
             yield "I couldn't generate a response. Please try again."
             
     except Exception as e:
         error(f"Error during run_turn: {e}")
+        outcome["error"] = str(e)
         yield f"I encountered an error: {str(e)}"
@@ -0,0 +1,141 @@
+"""
+Headless batch mode: run scripted conversations through the assistant without the Streamlit UI.
+
+Each input line is a JSON object with an optional "id" and either a "prompts" list
+(one conversation, one turn per prompt) or a single "prompt":
+
+    {"id": "acme-summer", "prompts": ["Show me posts from June 2024", "Boost the first one ..."]}
+    {"prompt": "Create a campaign called Test with a $5 daily budget for traffic"}
+
+Usage:
+    python batch.py conversations.jsonl -o results.jsonl --concurrency 4
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from assistant_client import create_thread, run_turn
+from logger import info, error, debug, warning
+
+def load_conversations(path: str) -> list[dict]:
+    conversations = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_no}: invalid JSON: {e}") from e
+            if not isinstance(item, dict):
+                raise ValueError(f"{path}:{line_no}: expected a JSON object, got {type(item).__name__}")
+
+            if "prompts" in item:
+                prompts = item["prompts"]
+            elif isinstance(item.get("prompt"), str):
+                prompts = [item["prompt"]]
+            else:
+                prompts = None
+            if not (isinstance(prompts, list) and prompts and all(isinstance(p, str) and p.strip() for p in prompts)):
+                raise ValueError(f"{path}:{line_no}: expected a non-empty 'prompts' list of strings or a 'prompt' string")
+            conversations.append({"id": str(item.get("id", line_no)), "prompts": prompts})
+    return conversations
+
+def run_conversation(conversation: dict) -> dict:
+    """
+    Run one conversation on a fresh thread and return its transcript, created IDs and latencies.
+    """
+    conv_id = conversation["id"]
+    result = {"id": conv_id, "thread_id": None, "created": {}, "transcript": [], "error": None}
+    start_time = time.time()
+    try:
+        result["thread_id"] = create_thread()
+        prompts = conversation["prompts"]
+        for turn_no, prompt in enumerate(prompts, 1):
+            outcome = {}
+            turn_start_time = time.time()
+            reply = "".join(run_turn(result["thread_id"], prompt, created=result["created"], outcome=outcome))
+            turn_duration = time.time() - turn_start_time
+            debug(f"Conversation {conv_id}: turn {turn_no} took {turn_duration:.2f}s")
+            result["transcript"].append({"role": "user", "content": prompt})
+            result["transcript"].append({"role": "assistant", "content": reply, "latency": round(turn_duration, 3)})
+            if outcome.get("error"):
+                # Later prompts assume this turn worked (e.g. "Yes, go ahead"), so don't send them
+                result["error"] = f"Turn {turn_no} failed: {outcome['error']}"
+                result["skipped_prompts"] = len(prompts) - turn_no
+                error(f"Conversation {conv_id}: {result['error']}, skipping {result['skipped_prompts']} remaining prompt(s)")
+                break
+    except Exception as e:
+        error(f"Conversation {conv_id} failed: {e}")
+        result["error"] = str(e)
+    result["latency"] = round(time.time() - start_time, 3)
+    return result
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run_batch(conversations: list[dict], output_path: str, concurrency: int) -> dict:
+    """
+    Run conversations concurrently, writing each result to `output_path` as soon as it finishes.
+    Returns aggregate throughput and latency stats.
+    """
+    info(f"Running {len(conversations)} conversation(s) with concurrency {concurrency}")
+    latencies = []
+    turns = 0
+    failed = 0
+    start_time = time.time()
+
+    with open(output_path, "w", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run_conversation, c) for c in conversations]
+        for future in as_completed(futures):
+            result = future.result()
+            latencies.append(result["latency"])
+            turns += len(result["transcript"]) // 2
+            if result["error"]:
+                failed += 1
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            info(f"Conversation {result['id']} finished in {result['latency']:.2f}s ({len(latencies)}/{len(conversations)})")
+
+    wall_time = time.time() - start_time
+    stats = {
+        "conversations": len(conversations),
+        "failed": failed,
+        "turns": turns,
+        "wall_time": round(wall_time, 3),
+        "conversations_per_min": round(len(conversations) / wall_time * 60, 2) if wall_time else 0.0,
+        "turns_per_min": round(turns / wall_time * 60, 2) if wall_time else 0.0,
+    }
+    if latencies:
+        stats.update({
+            "latency_p50": _percentile(latencies, 50),
+            "latency_p95": _percentile(latencies, 95),
+            "latency_max": max(latencies),
+        })
+    return stats
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run scripted conversations through the Facebook Ads AI Assistant.")
+    parser.add_argument("input", help="JSONL file of conversations")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="JSONL file for transcripts and created IDs")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Maximum conversations running at once")
+    args = parser.parse_args(argv)
+
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    conversations = load_conversations(args.input)
+    if not conversations:
+        warning(f"No conversations found in {args.input}")
+        return 0
+
+    stats = run_batch(conversations, args.output, args.concurrency)
+    info(f"Batch finished: {stats}")
+    print(json.dumps(stats, indent=2))
+    return 1 if stats["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,9 @@
+import copy
 import datetime
+import os
+from itertools import islice
+from typing import Callable, Iterator
+import requests
 import streamlit as st
 from facebook_business.api import FacebookAdsApi
 from facebook_business.adobjects.page import Page
@@ -6,7 +11,10 @@ from facebook_business.adobjects.adaccount import AdAccount
 from facebook_business.adobjects.campaign import Campaign
 from facebook_business.adobjects.adset import AdSet
 from facebook_business.adobjects.ad import Ad
+from facebook_business.exceptions import FacebookRequestError
 from logger import info, error, debug, warning
+from profiler import profiled
+from resilience import resilient_call
 
 PAGE_ID = st.secrets["FB_PAGE_ID"]
 raw_ad_acc_id = st.secrets["FB_AD_ACCOUNT_ID"]
@@ -30,14 +38,87 @@ except Exception as e:
     error(f"Error initializing Facebook Ads API: {e}")
     raise
 
-def get_posts_by_range(page_id: str, since: datetime.datetime, until: datetime.datetime) -> list[dict]:
+# Graph error codes for app/user/page-level throttling; the request was not processed
+_RATE_LIMIT_CODES = {4, 17, 32, 613}
+# Seconds before a slow post read gets a hedged duplicate request (0 disables hedging)
+HEDGE_AFTER = float(os.getenv("GRAPH_HEDGE_AFTER", "0"))
+
+def _is_rejected(e: Exception) -> bool:
+    return isinstance(e, FacebookRequestError) and (e.http_status() == 429 or e.api_error_code() in _RATE_LIMIT_CODES)
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, FacebookRequestError):
+        return _is_rejected(e) or bool(e.api_transient_error()) or (e.http_status() or 0) >= 500
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+def _graph_call(endpoint: str, fn, idempotent: bool = False, hedge_after: float | None = None):
+    return resilient_call(f"graph.{endpoint}", fn, idempotent=idempotent, hedge_after=hedge_after,
+                          is_transient=_is_transient, is_rejected=_is_rejected)
+
+def _load_next_page(cursor):
     """
-    Fetch posts including media URLs and permalink for richer previews.
+    Load the next page into a copy of the cursor, so retried or hedged attempts never share state.
+    Returns the copy and whether it holds any posts.
+    """
+    clone = copy.copy(cursor)
+    clone.params = dict(cursor.params)
+    has_posts = clone.load_next_page()
+    return clone, has_posts
+
+class PostRecord:
+    """
+    Compact view of a Page post: only the fields the assistant shows to the user.
+    """
+    __slots__ = ("id", "created_time", "excerpt", "full_picture", "permalink_url")
+
+    def __init__(self, id: str, created_time: str, excerpt: str, full_picture: str | None, permalink_url: str | None):
+        self.id = id
+        self.created_time = created_time
+        self.excerpt = excerpt
+        self.full_picture = full_picture          # may be None
+        self.permalink_url = permalink_url        # always present
+
+    @classmethod
+    def from_graph(cls, p) -> "PostRecord":
+        msg = p.get("message", "")
+        excerpt = (msg[:100] + ("…" if len(msg) > 100 else "")) or "<No text>"
+        return cls(
+            id=p["id"],
+            created_time=p.get("created_time", ""),
+            excerpt=excerpt,
+            full_picture=p.get("full_picture"),
+            permalink_url=p.get("permalink_url"),
+        )
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"PostRecord(id={self.id!r}, created_time={self.created_time!r})"
+
+def iter_posts(
+    page_id: str,
+    since: datetime.datetime,
+    until: datetime.datetime,
+    limit: int | None = None,
+    stop_when: Callable[[PostRecord], bool] | None = None,
+) -> Iterator[PostRecord]:
+    """
+    Yield posts page by page as Graph returns them.
+    Stops after `limit` posts, or at the first post for which `stop_when` returns True;
+    either way no further pages are requested.
     """
-    info(f"Fetching posts for page {page_id} from {since} to {until}")
+    info(f"Fetching posts for page {page_id} from {since} to {until} (limit={limit})")
+    params = {"since": since.isoformat(), "until": until.isoformat()}
+    if limit is not None:
+        if limit <= 0:
+            return
+        # Don't ask Graph for a bigger page than we are going to use
+        params["limit"] = min(limit, 100)
+
     try:
         page = Page(page_id)
-        posts = page.get_posts(
+        posts = _graph_call("page.get_posts", lambda: page.get_posts(
             fields=[
                 "id",
                 "created_time",
@@ -45,54 +126,50 @@ def get_posts_by_range(page_id: str, since: datetime.datetime, until: datetime.d
                 "full_picture",
                 "permalink_url",
             ],
-            params={"since": since.isoformat(), "until": until.isoformat()}
-        )
-        debug(f"Initial posts batch retrieved: {len(posts) if posts else 0}")
-        
-        results = []
-        for p in posts:
-            msg = p.get("message", "")
-            excerpt = (msg[:100] + ("…" if len(msg) > 100 else "")) or "<No text>"
-            results.append({
-                "id": p["id"],
-                "created_time": p.get("created_time", ""),
-                "excerpt": excerpt,
-                "full_picture": p.get("full_picture"),       # may be None
-                "permalink_url": p.get("permalink_url"),     # always present
-            })
-        
-        # paginate
-        page_count = 1
-        while posts:
-            try:
-                posts = posts.load_next_page()
-                if not posts:
-                    debug(f"No more pages available after page {page_count}")
-                    break
-                    
-                page_count += 1
-                debug(f"Retrieved page {page_count} with {len(posts)} posts")
-                
-                for p in posts:
-                    msg = p.get("message", "")
-                    excerpt = (msg[:100] + ("…" if len(msg) > 100 else "")) or "<No text>"
-                    results.append({
-                        "id": p["id"],
-                        "created_time": p.get("created_time", ""),
-                        "excerpt": excerpt,
-                        "full_picture": p.get("full_picture"),
-                        "permalink_url": p.get("permalink_url"),
-                    })
-            except Exception as e:
-                error(f"Error loading next page of posts: {e}")
-                break
-                
-        info(f"Total posts retrieved: {len(results)}")
-        return results
+            params=params
+        ), idempotent=True, hedge_after=HEDGE_AFTER)
     except Exception as e:
         error(f"Error fetching posts: {e}")
         raise
 
+    count = 0
+    page_count = 1
+    while True:
+        debug(f"Retrieved page {page_count} with {len(posts)} posts")
+        # Drain only the posts already loaded; iterating further would fetch the next page
+        for p in islice(posts, len(posts)):
+            record = PostRecord.from_graph(p)
+            if stop_when is not None and stop_when(record):
+                info(f"Stopped at post {record.id} after {count} posts")
+                return
+            yield record
+            count += 1
+            if limit is not None and count >= limit:
+                info(f"Reached limit of {limit} posts")
+                return
+
+        # paginate
+        try:
+            posts, has_posts = _graph_call("page.load_next_page", lambda cursor=posts: _load_next_page(cursor),
+                                           idempotent=True, hedge_after=HEDGE_AFTER)
+            if not has_posts:
+                debug(f"No more pages available after page {page_count}")
+                break
+        except Exception as e:
+            error(f"Error loading next page of posts: {e}")
+            break
+        page_count += 1
+
+    info(f"Total posts retrieved: {count}")
+
+@profiled()
+def get_posts_by_range(page_id: str, since: datetime.datetime, until: datetime.datetime, limit: int | None = None) -> list[dict]:
+    """
+    Fetch posts including media URLs and permalink for richer previews.
+    """
+    return [record.to_dict() for record in iter_posts(page_id, since, until, limit=limit)]
+
+@profiled()
 def create_campaign(name: str, objective: str, daily_budget: int, num_ads: int | None = None) -> dict:
     """
     Create a Facebook ad campaign under your ad account.
@@ -101,13 +178,13 @@ def create_campaign(name: str, objective: str, daily_budget: int, num_ads: int |
     info(f"Creating campaign '{name}' with objective '{objective}' and daily budget {daily_budget}")
     try:
         ad_account = AdAccount(AD_ACCOUNT_ID)
-        camp = ad_account.create_campaign(params={
+        camp = _graph_call("adaccount.create_campaign", lambda: ad_account.create_campaign(params={
             "name": name,
             "objective": objective,
             "status": Campaign.Status.paused,
             "daily_budget": str(daily_budget),
             "special_ad_categories": [],
-        })
+        }))
         debug(f"Campaign created with ID: {camp['id']}")
         
         res = {"campaign_id": camp["id"]}
@@ -118,6 +195,7 @@ def create_campaign(name: str, objective: str, daily_budget: int, num_ads: int |
         error(f"Error creating campaign: {e}")
         raise
 
+@profiled()
 def create_ad_set(campaign_id: str, optimization_goal: str, bid_amount: int, geo_locations: list[str]) -> str:
     """
     Create one paused Ad Set under the given campaign.
@@ -127,7 +205,7 @@ def create_ad_set(campaign_id: str, optimization_goal: str, bid_amount: int, geo
     try:
         targeting = {"geo_locations": {"countries": geo_locations}}
         ad_account = AdAccount(AD_ACCOUNT_ID)
-        adset = ad_account.create_ad_set(params={
+        adset = _graph_call("adaccount.create_ad_set", lambda: ad_account.create_ad_set(params={
             "name": f"AdSet for campaign {campaign_id}",
             "campaign_id": campaign_id,
             "billing_event": "IMPRESSIONS",
@@ -135,13 +213,14 @@ def create_ad_set(campaign_id: str, optimization_goal: str, bid_amount: int, geo
             "bid_amount": str(bid_amount),
             "targeting": targeting,
             "status": AdSet.Status.paused,
-        })
+        }))
         debug(f"Ad set created with ID: {adset['id']}")
         return adset["id"]
     except Exception as e:
         error(f"Error creating ad set: {e}")
         raise
 
+@profiled()
 def boost_posts(campaign_id: str, post_ids: list[str], optimization_goal: str, bid_amount: int, geo_locations: list[str]) -> dict:
     """
     For each post ID, create an AdCreative and an Ad under one Ad Set.
@@ -154,20 +233,20 @@ def boost_posts(campaign_id: str, post_ids: list[str], optimization_goal: str, b
         
         for pid in post_ids:
             debug(f"Creating creative for post {pid}")
-            creative = ad_account.create_ad_creative(params={
+            creative = _graph_call("adaccount.create_ad_creative", lambda: ad_account.create_ad_creative(params={
                 "name": f"Creative for post {pid}",
                 "object_story_id": pid,
-            })
+            }))
             creative_id = creative["id"]
             debug(f"Created creative ID: {creative_id}")
             
             debug(f"Creating ad for post {pid} with creative {creative_id}")
-            ad = ad_account.create_ad(params={
+            ad = _graph_call("adaccount.create_ad", lambda: ad_account.create_ad(params={
                 "name": f"Ad for post {pid}",
                 "adset_id": ad_set_id,
                 "creative": {"creative_id": creative_id},
                 "status": Ad.Status.paused,
-            })
+            }))
             ad_id = ad["id"]
             debug(f"Created ad ID: {ad_id}")
             ad_ids.append(ad_id)
@@ -0,0 +1,153 @@
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from logger import info, error, debug, warning
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+_TRUTHY = ("1", "true", "yes", "on")
+_local = threading.local()
+_cprofile_lock = threading.Lock()
+
+def profiling_enabled(flag: bool | None = None) -> bool:
+    """
+    An explicit per-request/session flag wins; otherwise fall back to the PROFILE_TURNS env variable.
+    """
+    if flag is not None:
+        return bool(flag)
+    return os.getenv("PROFILE_TURNS", "").strip().lower() in _TRUTHY
+
+def profiling_active() -> bool:
+    """True while the current thread is inside a turn that is being profiled."""
+    return bool(getattr(_local, "enabled", None))
+
+class _StackSampler(threading.Thread):
+    """
+    Periodically samples the Python stack of one thread and counts collapsed stacks
+    (root first, ';'-separated) in the format flamegraph.pl / speedscope expect.
+    """
+    def __init__(self, target_ident: int, interval: float):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.target_ident = target_ident
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_ident)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def _write_artifacts(label: str, prof: cProfile.Profile | None, sampler: _StackSampler | None, duration: float):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_label = re.sub(r"[^A-Za-z0-9_.-]+", "_", label)
+    base = os.path.join(PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{safe_label}")
+
+    written = []
+    if prof is not None:
+        prof.dump_stats(base + ".pstats")
+        written.append(base + ".pstats")
+    if sampler is not None:
+        with open(base + ".collapsed", "w") as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        written.append(base + ".collapsed")
+
+    info(f"Profile for '{label}' written to {', '.join(written)} ({duration:.2f}s)")
+
+def _start_profilers(label: str) -> tuple[cProfile.Profile | None, _StackSampler | None]:
+    """
+    Start the stack sampler and, if no other turn holds it, cProfile.
+    Never raises: whatever can't be started is skipped with a warning.
+    """
+    sampler = None
+    try:
+        sampler = _StackSampler(threading.get_ident(), SAMPLE_INTERVAL)
+        sampler.start()
+    except Exception as e:
+        warning(f"Could not start stack sampler for '{label}': {e}")
+        sampler = None
+
+    # Only one cProfile can be active per process (enforced from Python 3.12). From 3.12 it also
+    # records calls from every thread, so .pstats mixes in other concurrent turns; .collapsed doesn't.
+    if not _cprofile_lock.acquire(blocking=False):
+        warning(f"Another turn is already being profiled, '{label}' gets stack samples only")
+        return None, sampler
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except Exception as e:
+        warning(f"Could not start cProfile for '{label}', stack samples only: {e}")
+        _cprofile_lock.release()
+        return None, sampler
+    return prof, sampler
+
+@contextmanager
+def profile_turn(label: str, enabled: bool | None = None):
+    """
+    Profile everything the current thread does inside the block and write a
+    .pstats file plus a .collapsed stack file to PROFILE_DIR.
+    The decision is made once per thread: nested blocks and @profiled calls are folded
+    into the outermost one, or stay off if it was switched off.
+    Profiling problems are logged and never raised into the block.
+    """
+    if getattr(_local, "enabled", None) is not None:
+        yield
+        return
+
+    _local.enabled = profiling_enabled(enabled)
+    prof = sampler = None
+    start_time = time.time()
+    try:
+        if _local.enabled:
+            debug(f"Profiling '{label}'")
+            prof, sampler = _start_profilers(label)
+        yield
+    finally:
+        _local.enabled = None
+        if prof is not None:
+            prof.disable()
+            _cprofile_lock.release()
+        if sampler is not None:
+            sampler.stop()
+        if prof is not None or sampler is not None:
+            try:
+                _write_artifacts(label, prof, sampler, time.time() - start_time)
+            except Exception as e:
+                error(f"Error writing profile for '{label}': {e}")
+
+def profiled(label: str | None = None):
+    """
+    Decorator: profile each call of the function on its own when profiling is enabled
+    via PROFILE_TURNS. Inside a turn the call follows that turn's decision instead.
+    """
+    def decorator(func):
+        name = label or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "enabled", None) is not None or not profiling_enabled():
+                return func(*args, **kwargs)
+            with profile_turn(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
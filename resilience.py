@@ -0,0 +1,230 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from typing import Callable, TypeVar
+from logger import info, error, debug, warning
+from profiler import profiling_active
+
+T = TypeVar("T")
+
+MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+# Grace period before checking whether a failed non-idempotent call landed anyway, so a
+# request the server is still processing (e.g. after a client timeout) has time to show up
+RECOVER_DELAY = float(os.getenv("RETRY_RECOVER_DELAY", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+HEDGE_MAX_IN_FLIGHT = int(os.getenv("HEDGE_MAX_IN_FLIGHT", "8"))
+
+# Hedged calls run here so the caller can wait on whichever finishes first. Work is only
+# submitted when a worker is free (see _submit_hedged), so nothing ever queues behind it.
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_MAX_IN_FLIGHT, thread_name_prefix="hedge")
+_hedge_slots = threading.BoundedSemaphore(HEDGE_MAX_IN_FLIGHT)
+
+class CircuitOpenError(Exception):
+    """Raised without calling out when an endpoint's circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Per-endpoint breaker: opens after `failure_threshold` consecutive failed calls (each counted
+    once, after its retries), fails fast for `reset_timeout` seconds, then lets a single trial
+    call through (half-open).
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                info(f"Circuit {self.name} half-open, allowing a trial call")
+                self.state = self.HALF_OPEN
+                return True
+            # OPEN within timeout, or HALF_OPEN with the trial call still in flight
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                info(f"Circuit {self.name} closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    error(f"Circuit {self.name} opened after {self.failures} consecutive failure(s)")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_interrupted(self):
+        """
+        The call was interrupted (KeyboardInterrupt, thread shutdown, ...) and tells us nothing
+        about the dependency. A half-open trial goes back to OPEN so a later call can try again.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(endpoint)
+        return _breakers[endpoint]
+
+def default_is_transient(e: Exception) -> bool:
+    status = getattr(e, "status_code", None)
+    return isinstance(e, (ConnectionError, TimeoutError)) or (status is not None and (status == 429 or status >= 500))
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given 1-based attempt."""
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** (attempt - 1)))
+
+def _submit_hedged(fn: Callable[[], T]) -> Future | None:
+    """Run `fn` on the hedge pool if a worker is free right now, else return None."""
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+    try:
+        future = _hedge_pool.submit(fn)
+    except Exception:
+        _hedge_slots.release()
+        raise
+    future.add_done_callback(lambda f: _hedge_slots.release())
+    return future
+
+def _hedged(fn: Callable[[], T], hedge_after: float) -> T:
+    """
+    Run `fn`; if it hasn't finished after `hedge_after` seconds, start a duplicate
+    and return whichever succeeds first. Only safe for idempotent reads.
+    When the pool is saturated the call runs without hedging rather than adding load.
+    """
+    # A profiled turn's stack sampler only sees its own thread, so keep the call there
+    if profiling_active():
+        return fn()
+
+    primary = _submit_hedged(fn)
+    if primary is None:
+        debug("Hedge pool busy, calling without hedging")
+        return fn()
+    try:
+        return primary.result(timeout=hedge_after)
+    except FutureTimeout:
+        pass
+
+    backup = _submit_hedged(fn)
+    if backup is None:
+        debug(f"Call still running after {hedge_after:.2f}s but hedge pool is busy, waiting")
+        return primary.result()
+
+    debug(f"Call still running after {hedge_after:.2f}s, sending hedged duplicate")
+    first_error = None
+    for future in as_completed([primary, backup]):
+        exc = future.exception()
+        if exc is None:
+            return future.result()
+        first_error = first_error or exc
+    raise first_error
+
+def resilient_call(
+    endpoint: str,
+    fn: Callable[[], T],
+    idempotent: bool = False,
+    hedge_after: float | None = None,
+    is_transient: Callable[[Exception], bool] = default_is_transient,
+    is_rejected: Callable[[Exception], bool] = lambda e: False,
+    retry_after: Callable[[Exception], float | None] = lambda e: None,
+    recover: Callable[[], T | None] | None = None,
+) -> T:
+    """
+    Call `fn` behind the circuit breaker for `endpoint`.
+
+    Transient failures (`is_transient`) are retried with jittered exponential backoff,
+    or after the delay the server asked for (`retry_after`), but only when that is safe:
+    - idempotent calls are always retried;
+    - non-idempotent calls are retried when the error shows the request was rejected before
+      being processed (`is_rejected`, e.g. rate limits), or when `recover` confirms it never
+      landed by returning None (checked RECOVER_DELAY seconds after the failure). If `recover`
+      returns a value, the request did land and that value is the result. A request still in
+      flight after the check can land late, so this makes duplicates unlikely, not impossible.
+    `hedge_after` enables hedged duplicates for idempotent calls.
+    The breaker sees one outcome per call, after retries are exhausted.
+    """
+    breaker = get_breaker(endpoint)
+    if not breaker.allow():
+        raise CircuitOpenError(f"{endpoint} is temporarily unavailable, please try again shortly")
+    try:
+        result = _call_with_retries(endpoint, fn, idempotent, hedge_after, is_transient, is_rejected, retry_after, recover)
+    except Exception as e:
+        if is_transient(e):
+            breaker.record_failure()
+        else:
+            # The dependency answered; the request itself was bad
+            breaker.record_success()
+        raise
+    except BaseException:
+        breaker.record_interrupted()
+        raise
+    breaker.record_success()
+    return result
+
+def _call_with_retries(
+    endpoint: str,
+    fn: Callable[[], T],
+    idempotent: bool,
+    hedge_after: float | None,
+    is_transient: Callable[[Exception], bool],
+    is_rejected: Callable[[Exception], bool],
+    retry_after: Callable[[Exception], float | None],
+    recover: Callable[[], T | None] | None,
+) -> T:
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            if idempotent and hedge_after:
+                return _hedged(fn, hedge_after)
+            return fn()
+        except Exception as e:
+            if is_rejected(e) or (idempotent and is_transient(e)):
+                retryable = True
+            elif is_transient(e) and recover is not None:
+                try:
+                    time.sleep(RECOVER_DELAY)
+                    landed = recover()
+                except Exception as check_error:
+                    warning(f"{endpoint} failed ({e}) and checking whether it went through failed too ({check_error})")
+                    raise e
+                if landed is not None:
+                    info(f"{endpoint} failed ({e}) but the request went through")
+                    return landed
+                retryable = True
+            else:
+                retryable = False
+            if not retryable or attempt == MAX_ATTEMPTS:
+                raise
+
+            delay = retry_after(e)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            elif delay > MAX_DELAY:
+                warning(f"{endpoint} failed ({e}), server asked to retry in {delay:.2f}s which is over RETRY_MAX_DELAY")
+                raise
+            warning(f"{endpoint} failed ({e}), retry {attempt}/{MAX_ATTEMPTS - 1} in {delay:.2f}s")
+            time.sleep(delay)
@@ -14,7 +14,7 @@ assistant = client.beta.assistants.create(
     - Boosting existing posts
 
     You have access to the following tools:
-        - GetPosts : Retrieves posts from your Facebook Page over a specified date range. Input must be a JSON string with 'since' and 'until' in ISO format (YYYY-MM-DD). Example: {"since": "2023-01-01", "until": "2023-01-31"}
+        - GetPosts : Retrieves posts from your Facebook Page over a specified date range. Input must be a JSON string with 'since' and 'until' in ISO format (YYYY-MM-DD). Optional 'limit' caps how many posts are returned (newest first) — use it when the user only wants the latest few. Example: {"since": "2023-01-01", "until": "2023-01-31", "limit": 5}
         - CreateCampaign : Creates a paused Facebook ad campaign. Input must be a JSON string with 'name', 'objective', and 'budget' fields. Example: {"name": "Summer Sale", "objective": "OUTCOME_TRAFFIC", "budget": 10.0} Valid objectives: OUTCOME_ENGAGEMENT, OUTCOME_LEADS, OUTCOME_SALES, OUTCOME_TRAFFIC, OUTCOME_AWARENESS, OUTCOME_APP_PROMOTION
         - BoostPosts : Boost specific posts under an existing campaign. Input must be a JSON string with 'campaign_id', 'post_ids', 'optimization_goal', 'bid_amount', and 'geo_locations' fields. Example: {"campaign_id": "123456", "post_ids": ["post1", "post2"], "optimization_goal": "POST_ENGAGEMENT", "bid_amount": 5.0, "geo_locations": ["US", "CA"]} Valid optimization goals: POST_ENGAGEMENT, LINK_CLICKS, IMPRESSIONS, REACH, PAGE_LIKES, OFFSITE_CONVERSIONS, VIDEO_VIEWS
 
@@ -121,7 +121,8 @@ assistant = client.beta.assistants.create(
             "type": "object",
             "properties": {
               "since": {"type": "string", "format": "date"},
-              "until": {"type": "string", "format": "date"}
+              "until": {"type": "string", "format": "date"},
+              "limit": {"type": "integer", "description": "Maximum number of posts to return, newest first."}
             },
             "required": ["since", "until"]
           },